@@ -175,9 +175,11 @@ Python modules:
 
 * watchdog_ [#nopy3k]_
 * parsedatetime_ [#nopy3k]_
+* orjson_ (optional; makes recording and indexing faster)
 
 .. _watchdog: http://pypi.python.org/pypi/watchdog/
 .. _parsedatetime: http://pypi.python.org/pypi/parsedatetime/
+.. _orjson: http://pypi.python.org/pypi/orjson/
 
 .. [#nopy3k] These modules do not support Python 3.
              They are not installed in if you use Python 3
@@ -17,8 +17,9 @@
 import os
 import re
 import sqlite3
-from contextlib import closing, contextmanager
+from contextlib import contextmanager
 import datetime
+import calendar
 import warnings
 import itertools
 
@@ -28,24 +29,124 @@ from .utils.iterutils import nonempty, include_before, include_after, \
 from .utils.sqlconstructor import SQLConstructor
 from .model import CommandRecord, SessionRecord, VersionRecord, EnvironRecord
 
-schema_version = '0.1'
+schema_version = '0.2'
+
+_RE_CREATE_IF_NOT_EXISTS = re.compile(
+    r'CREATE (?:UNIQUE )?(?:INDEX|TABLE) IF NOT EXISTS [^;]*', re.IGNORECASE)
+
+_PRAGMAS = [
+    'synchronous=NORMAL',
+    'temp_store=MEMORY',
+    'cache_size=-20000',      # 20 MB
+    'mmap_size=268435456',    # 256 MB
+]
+
+_SQL_INSERT_CH = """
+INSERT INTO command_history
+    (command_id, session_id, directory_id, terminal_id,
+     start_time, stop_time, exit_code)
+VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+
+_SQL_INSERT_ENV_MAP = """
+INSERT INTO {0}
+    ({1}, ev_id)
+VALUES
+"""
+
+_SQL_INSERT_TRIGRAM = """
+INSERT OR IGNORE INTO command_trigrams
+    (trigram, command_id)
+VALUES (?, ?)
+"""
+
+_SQL_INSERT_PIPE = """
+INSERT INTO pipe_status_map
+    (ch_id, program_position, exit_code)
+VALUES
+"""
+
+_SQL_MIGRATE_TIMESTAMP = """
+UPDATE {0}
+SET {1} = CAST(strftime('%s', {1}) AS INTEGER)
+WHERE typeof({1}) = 'text'
+"""
+
+_SQL_DEDUPLICATE_ENVIRON = """
+CREATE TEMP TABLE environ_id_map AS
+SELECT EV.id AS old_id, Keep.id AS new_id
+FROM environment_variable AS EV
+JOIN (SELECT MIN(id) AS id, variable_name, variable_value
+      FROM environment_variable
+      GROUP BY variable_name, variable_value) AS Keep
+ON EV.variable_name = Keep.variable_name AND
+   EV.variable_value = Keep.variable_value
+WHERE EV.id != Keep.id;
+
+UPDATE command_environment_map
+SET ev_id = (SELECT new_id FROM environ_id_map WHERE old_id = ev_id)
+WHERE ev_id IN (SELECT old_id FROM environ_id_map);
+
+UPDATE session_environment_map
+SET ev_id = (SELECT new_id FROM environ_id_map WHERE old_id = ev_id)
+WHERE ev_id IN (SELECT old_id FROM environ_id_map);
+
+DELETE FROM environment_variable
+WHERE id IN (SELECT old_id FROM environ_id_map);
+
+DROP TABLE environ_id_map;
+"""
+
+_SQLITE_MAX_VARIABLE_NUMBER = 999
+"""
+Maximum number of parameters in one statement for SQLite < 3.32.
+"""
+
+
+_TIMESTAMP_FORMATS = [
+    '%Y-%m-%d %H:%M:%S',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M',
+    '%Y-%m-%d',
+]
+"""
+Formats of time strings accepted by :func:`convert_ts` (in UTC).
+"""
 
 
 def convert_ts(ts):
     """
-    Convert timestamp (ts)
+    Convert timestamp (ts) to Unix time stored in DB.
 
-    :type ts: int or str or None
-    :arg  ts: Unix timestamp
-    :rtype: datetime.datetime or str or None
+    >>> convert_ts(datetime.datetime(1970, 1, 2))
+    86400
+    >>> convert_ts(86400.5)
+    86400
+    >>> convert_ts('1970-01-02')
+    86400
+    >>> convert_ts('1970-01-02 00:00:01')
+    86401
+
+    Strings in other formats are returned as-is.
+
+    :type ts: int or float or str or datetime.datetime or None
+    :arg  ts: Unix timestamp, or datetime (naive or string) in UTC
+    :rtype: int or None
 
     """
     if ts is None:
         return None
+    if isinstance(ts, datetime.datetime):
+        return calendar.timegm(ts.utctimetuple())
     try:
-        return datetime.datetime.utcfromtimestamp(ts)
-    except TypeError:
+        return int(ts)
+    except (TypeError, ValueError):
         pass
+    for fmt in _TIMESTAMP_FORMATS:
+        try:
+            return convert_ts(datetime.datetime.strptime(ts, fmt))
+        except (TypeError, ValueError):
+            pass
     return ts
 
 
@@ -61,6 +162,222 @@ def normalize_directory(path):
         return path + os.path.sep
 
 
+HAS_UPSERT_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+"""
+True if SQLite supports ``INSERT ... ON CONFLICT ... RETURNING``.
+"""
+
+_insert_sql_cache = {}
+_select_insert_sql_cache = {}
+
+_ENVIRON_COLUMNS = ('variable_name', 'variable_value')
+
+
+def _bulk_insert(db, sql_prefix, cols, rows, chunk=500):
+    """
+    Insert `rows` using multi-row ``VALUES (?, ?), (?, ?), ...``.
+
+    `sql_prefix` is an INSERT statement up to ``VALUES``.  `rows` is
+    a list of tuples of length `cols`.  Each statement inserts at most
+    `chunk` rows and takes at most :data:`_SQLITE_MAX_VARIABLE_NUMBER`
+    parameters.
+
+    >>> db = sqlite3.connect(':memory:')
+    >>> _ = db.execute('CREATE TABLE t (a, b)')
+    >>> rows = [(i, -i) for i in range(1000)]
+    >>> _bulk_insert(db, 'INSERT INTO t (a, b) VALUES', 2, rows)
+    >>> db.execute('SELECT COUNT(*), SUM(a + b) FROM t').fetchone()
+    (1000, 0)
+
+    """
+    chunk = max(1, min(chunk, _SQLITE_MAX_VARIABLE_NUMBER // cols))
+    value = '(' + ', '.join(['?'] * cols) + ')'
+    sql = None
+    for i in range(0, len(rows), chunk):
+        part = rows[i:i + chunk]
+        if sql is None or len(part) < chunk:
+            sql = sql_prefix + ' ' + ', '.join([value] * len(part))
+        db.execute(sql, list(itertools.chain.from_iterable(part)))
+
+
+def sql_insert_returning_id(table, names):
+    """
+    Return SQL to insert a row into `table` and get its ID.
+
+    No row is returned if the row already exists.  Unlike ``DO UPDATE``,
+    ``DO NOTHING`` neither rewrites the existing row nor uses up a
+    value of ``sqlite_sequence``.  Columns `names` must have a UNIQUE
+    constraint.
+
+    >>> print(sql_insert_returning_id('command_list', ('command',)))
+    ... # doctest: +NORMALIZE_WHITESPACE
+    INSERT INTO "command_list" ("command") VALUES (?)
+    ON CONFLICT DO NOTHING RETURNING id
+
+    :type  table: str
+    :type  names: tuple of str
+
+    """
+    key = (table, names)
+    sql = _insert_sql_cache.get(key)
+    if sql is None:
+        sql = _insert_sql_cache[key] = (
+            'INSERT INTO "{0}" ({1}) VALUES ({2}) '
+            'ON CONFLICT DO NOTHING RETURNING id'
+        ).format(table,
+                 ', '.join(map('"{0}"'.format, names)),
+                 ', '.join('?' for _ in names))
+    return sql
+
+
+def sql_select_or_insert_id(table, names):
+    """
+    Return SQL to get ID of a row in `table` and SQL to insert the row.
+
+    The INSERT is used when :data:`HAS_UPSERT_RETURNING` is false.
+
+    >>> (select, insert) = sql_select_or_insert_id('command_list',
+    ...                                            ('command',))
+    >>> print(select)
+    SELECT id FROM "command_list" WHERE "command" = ?
+    >>> print(insert)
+    INSERT INTO "command_list" ("command") VALUES (?)
+
+    :type  table: str
+    :type  names: tuple of str
+
+    """
+    key = (table, names)
+    sqls = _select_insert_sql_cache.get(key)
+    if sqls is None:
+        sqls = _select_insert_sql_cache[key] = (
+            'SELECT id FROM "{0}" WHERE {1}'.format(
+                table, ' AND '.join(map('"{0}" = ?'.format, names))),
+            'INSERT INTO "{0}" ({1}) VALUES ({2})'.format(
+                table, ', '.join(map('"{0}"'.format, names)),
+                ', '.join('?' for _ in names)))
+    return sqls
+
+
+_SEARCH_ENVIRON_KEYS = frozenset([
+    'match_environ_pattern', 'include_environ_pattern',
+    'exclude_environ_pattern',
+    'match_environ_regexp', 'include_environ_regexp',
+    'exclude_environ_regexp',
+])
+"""
+Search parameters given as lists of ``(name, value)`` pairs.
+"""
+
+_SEARCH_PARAM_KEYS = _SEARCH_ENVIRON_KEYS | frozenset([
+    'match_pattern', 'include_pattern', 'exclude_pattern',
+    'match_regexp', 'include_regexp', 'exclude_regexp',
+    'cwd', 'cwd_glob',
+    'time_after', 'time_before',
+    'duration_longer_than', 'duration_less_than',
+    'include_exit_code', 'exclude_exit_code',
+    'include_session_history_id', 'exclude_session_history_id',
+    'sort_by_cwd_distance',
+    'match_pattern_trigrams',
+])
+"""
+Search parameters given as lists whose values are passed to SQLite.
+"""
+
+_SEARCH_TEMPLATE_CACHE_SIZE = 64
+_search_template_cache = {}
+
+
+class _SearchParam(object):
+
+    """
+    Placeholder for a search parameter in a cached SQL template.
+
+    >>> kwds = {'cwd': ['/a/', '/b/'], 'match_environ_pattern': [('E', 'v')]}
+    >>> _SearchParam('cwd', 1).resolve(kwds)
+    '/b/'
+    >>> _SearchParam('match_environ_pattern', 0, 1).resolve(kwds)
+    'v'
+
+    """
+
+    def __init__(self, key, index, item=None):
+        self.key = key
+        self.index = index
+        self.item = item
+
+    def resolve(self, kwds):
+        value = kwds[self.key][self.index]
+        if self.item is None:
+            return value
+        return value[self.item]
+
+
+def _search_param_shape(key, values):
+    if key == 'match_pattern_trigrams':
+        return tuple(map(len, values))
+    return len(values)
+
+
+def _search_placeholders(kwds):
+    """
+    Replace parameters in `kwds` with :class:`_SearchParam`.
+    """
+    placeholders = dict(kwds)
+    for (key, values) in kwds.items():
+        if key == 'match_pattern_trigrams':
+            placeholders[key] = [
+                [_SearchParam(key, i, j) for j in range(len(trigrams))]
+                for (i, trigrams) in enumerate(values)]
+        elif key in _SEARCH_ENVIRON_KEYS:
+            placeholders[key] = [
+                (_SearchParam(key, i, 0), _SearchParam(key, i, 1))
+                for i in range(len(values))]
+        elif key in _SEARCH_PARAM_KEYS:
+            placeholders[key] = [
+                _SearchParam(key, i) for i in range(len(values))]
+    return placeholders
+
+
+def _hashable(value):
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(value))
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+def trigrams(string):
+    """
+    Return a set of substrings of length 3 in `string`.
+
+    >>> sorted(trigrams('make'))
+    ['ake', 'mak']
+    >>> trigrams('ls') == set()
+    True
+
+    """
+    return set(string[i:i + 3] for i in range(len(string) - 2))
+
+
+_RE_GLOB_SPECIAL = re.compile(r'\*|\?|\[\^?\]?[^]]*\]?')
+
+
+def glob_trigrams(pattern):
+    """
+    Return trigrams any string matching glob `pattern` must contain.
+
+    >>> sorted(glob_trigrams('*make*'))
+    ['ake', 'mak']
+    >>> sorted(glob_trigrams('*git?st[au]tus*'))
+    ['git', 'tus']
+    >>> sorted(glob_trigrams('[^]x]abc'))
+    ['abc']
+
+    """
+    return set().union(*map(trigrams, _RE_GLOB_SPECIAL.split(pattern)))
+
+
 def sql_regexp_func(expr, item):
     return re.match(expr, item) is not None
 
@@ -112,24 +429,95 @@ class DataBase(object):
         self.dbpath = dbpath
         if not os.path.exists(dbpath):
             self._init_db()
+        self._ensure_schema()
+        self._migrate_timestamps()
         self.update_version_records()
 
     def _get_db(self):
         """Returns a new connection to the database."""
-        return closing(sqlite3.connect(self.dbpath))
+        db = sqlite3.connect(self.dbpath, check_same_thread=False)
+        self._set_pragmas(db)
+        return db
+
+    def _set_pragmas(self, db):
+        """
+        Tune `db` for speed.
+
+        Write-ahead logging with ``synchronous=NORMAL`` only syncs at
+        checkpoints, which is much faster than the default rollback
+        journal for many small transactions, while the database stays
+        consistent after a crash.
+
+        """
+        pragmas = _PRAGMAS
+        if self.dbpath != ':memory:':
+            pragmas = ['journal_mode=WAL'] + pragmas
+        db.executescript(''.join(map('PRAGMA {0};'.format, pragmas)))
 
     def _init_db(self):
         """Creates the database tables."""
-        with self._get_db() as db:
+        with self.connection(commit=True) as db:
             with open(self.schemapath) as f:
                 db.cursor().executescript(f.read())
-            db.commit()
+
+    def _ensure_schema(self):
+        """
+        Create tables and indexes added to the schema if they do not exist.
+
+        This upgrades databases created by older versions of RASH.
+        The ``command_trigrams`` table is filled for existing commands
+        when it is created.  Duplicated environment variables, which
+        older versions could insert when indexing concurrently, are
+        merged before their UNIQUE index is created.
+
+        """
+        with open(self.schemapath) as f:
+            statements = _RE_CREATE_IF_NOT_EXISTS.findall(f.read())
+        with self.connection(commit=True) as connection:
+            exists = lambda type, name: nonempty(connection.execute(
+                'SELECT 1 FROM sqlite_master WHERE type = ? AND name = ?',
+                [type, name]))
+            has_trigrams = exists('table', 'command_trigrams')
+            if not exists('index', 'idx_environment_variable'):
+                for sql in _SQL_DEDUPLICATE_ENVIRON.split(';'):
+                    connection.execute(sql)
+            for sql in statements:
+                connection.execute(sql)
+            if not has_trigrams:
+                commands = list(connection.execute(
+                    'SELECT id, command FROM command_list'))
+                connection.executemany(_SQL_INSERT_TRIGRAM, (
+                    (t, command_id)
+                    for (command_id, command) in commands
+                    for t in trigrams(command)))
+
+    def _migrate_timestamps(self):
+        """
+        Convert timestamps stored by schema version 0.1 to Unix time.
+
+        Schema version 0.1 stored `start_time` and `stop_time` as text
+        such as ``2013-01-01 00:00:00`` (UTC).
+
+        """
+        with self.connection(commit=True) as connection:
+            vrec = next(self.get_version_records(), None)
+            if vrec is None or vrec.schema_version != '0.1':
+                return
+            for table in ['command_history', 'session_history']:
+                for column in ['start_time', 'stop_time']:
+                    connection.execute(
+                        _SQL_MIGRATE_TIMESTAMP.format(table, column))
 
     @contextmanager
     def connection(self, commit=False):
         """
         Context manager to keep around DB connection.
 
+        The connection is opened at the first use and kept open until
+        :meth:`close` is called.  Changes are committed at the end of
+        the outermost block if any of the blocks is given
+        ``commit=True``, and rolled back if an error is raised.
+
         :rtype: sqlite3.Connection
 
         SOMEDAY: Get rid of this function.  Keeping connection around as
@@ -142,25 +530,48 @@ class DataBase(object):
         """
         if commit:
             self._need_commit = True
-        if self._db:
+        if self._db is not None and self._active_db is self._db:
             yield self._db
-        else:
-            try:
-                with self._get_db() as db:
-                    self._db = db
-                    db.create_function("REGEXP", 2, sql_regexp_func)
-                    db.create_function("PROGRAM_NAME", 1,
-                                       sql_program_name_func)
-                    db.create_function("PATHDIST", 2, sql_pathdist_func)
-                    yield self._db
-                    if self._need_commit:
-                        db.commit()
-            finally:
-                self._db = None
-                self._need_commit = False
+            return
+        db = self._db
+        if db is None:
+            db = self._db = self._get_db()
+            db.row_factory = sqlite3.Row
+            db.create_function("REGEXP", 2, sql_regexp_func)
+            db.create_function("PROGRAM_NAME", 1, sql_program_name_func)
+            db.create_function("PATHDIST", 2, sql_pathdist_func)
+        self._active_db = db
+        try:
+            yield db
+            if self._need_commit and self._db is db:
+                db.commit()
+        except:
+            if self._db is db:
+                db.rollback()
+            raise
+        finally:
+            if self._active_db is db:
+                self._active_db = None
+            self._need_commit = False
+            if self._db is not db:
+                # Dropped by close_connection or close while in use.
+                db.close()
     _db = None
+    _active_db = None
     _need_commit = False
 
+    def close(self):
+        """
+        Close the connection kept by :meth:`connection`.
+
+        A new connection is opened when it is needed again.
+
+        """
+        if self._db is not None:
+            db = self._db
+            self._db = None
+            db.close()
+
     def close_connection(self):
         """
         Close connection kept by :meth:`connection`.
@@ -184,6 +595,8 @@ class DataBase(object):
                 db.interrupt()
                 self._db = None
                 self._need_commit = False
+                if self._active_db is not db:
+                    db.close()
 
     def _executing(self, sql, params=[]):
         """
@@ -232,25 +645,65 @@ class DataBase(object):
                 [version, schema_version])
 
     def import_json(self, json_path, **kwds):
-        import json
-        with open(json_path) as fp:
+        from .utils.jsonutils import loads
+        with open(json_path, 'rb') as fp:
             try:
-                dct = json.load(fp)
+                dct = loads(fp.read())
             except ValueError:
                 warnings.warn(
                     'Ignoring invalid JSON file at: {0}'.format(json_path))
                 return
-        self.import_dict(dct, **kwds)
+        self.import_dicts([dct], **kwds)
 
     def import_dict(self, dct, check_duplicate=True):
-        crec = CommandRecord(**dct)
-        if check_duplicate and nonempty(self.select_by_command_record(crec)):
-            return
-        with self.connection(commit=True) as connection:
-            db = connection.cursor()
+        self.import_dicts([dct], check_duplicate)
+
+    def import_dicts(self, dcts, check_duplicate=True):
+        """
+        Import command records given as an iterable of dictionaries.
+
+        All records are inserted in one transaction which is committed
+        once at the end.  Environment variables and pipe statuses of
+        all records are inserted at once using multi-row INSERT
+        statements (see :func:`_bulk_insert`).  IDs of commands,
+        directories, etc. are cached during the import.
+
+        :type             dcts: [dict]
+        :type  check_duplicate: bool
+        :arg   check_duplicate: Do not import a record if the same
+                                record is already in the database.
+
+        """
+        self._id_cache = {}
+        try:
+            with self.connection(commit=True) as connection:
+                self._import_dicts(connection.cursor(), dcts, check_duplicate)
+        finally:
+            self._id_cache = None
+
+    def _import_dicts(self, db, dcts, check_duplicate):
+        env_rows = []
+        pipe_rows = []
+        for dct in dcts:
+            crec = CommandRecord(**dct)
+            if (check_duplicate and
+                    nonempty(self.select_by_command_record(crec))):
+                continue
             ch_id = self._insert_command_history(db, crec)
-            self._isnert_command_environment(db, ch_id, crec.environ)
-            self._insert_pipe_status(db, ch_id, crec.pipestatus)
+            env_rows.extend(
+                (ch_id, ev_id)
+                for ev_id in self._get_environ_ids(db, crec.environ))
+            pipe_rows.extend(
+                (ch_id, i, code)
+                for (i, code) in enumerate(crec.pipestatus or []))
+        _bulk_insert(db, _SQL_INSERT_ENV_MAP.format(
+            'command_environment_map', 'ch_id'), 2, env_rows)
+        _bulk_insert(db, _SQL_INSERT_PIPE, 3, pipe_rows)
+
+    _id_cache = None
+    """
+    Map ``(table, values)`` to ID while :meth:`import_dicts` is running.
+    """
 
     def _insert_command_history(self, db, crec):
         command_id = self._get_maybe_new_command_id(db, crec.command)
@@ -258,90 +711,100 @@ class DataBase(object):
         directory_id = self._get_maybe_new_directory_id(db, crec.cwd)
         terminal_id = self._get_maybe_new_terminal_id(db, crec.terminal)
         db.execute(
-            '''
-            INSERT INTO command_history
-                (command_id, session_id, directory_id, terminal_id,
-                 start_time, stop_time, exit_code)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''',
+            _SQL_INSERT_CH,
             [command_id, session_id, directory_id, terminal_id,
              convert_ts(crec.start), convert_ts(crec.stop), crec.exit_code])
         return db.lastrowid
 
-    def _isnert_command_environment(self, db, ch_id, environ):
-        self._insert_environ(db, 'command_environment_map', 'ch_id', ch_id,
-                             environ)
+    def _get_environ_ids(self, db, environ):
+        """
+        Return a list of IDs of the environment variables in `environ`.
+        """
+        if not environ:
+            return []
+        return [
+            self._get_maybe_new_id(db, 'environment_variable',
+                                   _ENVIRON_COLUMNS, (name, value))
+            for (name, value) in environ.items()
+            if name is not None and value is not None]
 
     def _insert_environ(self, db, table, id_name, ch_id, environ):
-        if not environ:
-            return
-        for (name, value) in environ.items():
-            if name is None or value is None:
-                continue
-            ev_id = self._get_maybe_new_id(
-                db, 'environment_variable',
-                {'variable_name': name, 'variable_value': value})
-            db.execute(
-                '''
-                INSERT INTO {0}
-                    ({1}, ev_id)
-                VALUES (?, ?)
-                '''.format(table, id_name),
-                [ch_id, ev_id])
-
-    def _insert_pipe_status(self, db, ch_id, pipe_status):
-        if not pipe_status:
-            return
-        for (i, code) in enumerate(pipe_status):
-            db.execute(
-                '''
-                INSERT INTO pipe_status_map
-                    (ch_id, program_position, exit_code)
-                VALUES (?, ?, ?)
-                ''',
-                [ch_id, i, code])
+        _bulk_insert(db, _SQL_INSERT_ENV_MAP.format(table, id_name), 2,
+                     [(ch_id, ev_id)
+                      for ev_id in self._get_environ_ids(db, environ)])
 
     def _get_maybe_new_command_id(self, db, command):
         if command is None:
             return None
         return self._get_maybe_new_id(
-            db, 'command_list', {'command': command})
+            db, 'command_list', ('command',), (command,),
+            on_insert=lambda command_id: self._insert_command_trigrams(
+                db, command_id, command))
+
+    def _insert_command_trigrams(self, db, command_id, command):
+        db.executemany(_SQL_INSERT_TRIGRAM,
+                       [(t, command_id) for t in trigrams(command)])
 
     def _get_maybe_new_session_id(self, db, session_long_id):
         if session_long_id is None:
             return None
         return self._get_maybe_new_id(
-            db, 'session_history', {'session_long_id': session_long_id})
+            db, 'session_history', ('session_long_id',), (session_long_id,))
 
     def _get_maybe_new_directory_id(self, db, directory):
         if directory is None:
             return None
         directory = normalize_directory(directory)
         return self._get_maybe_new_id(
-            db, 'directory_list', {'directory': directory})
+            db, 'directory_list', ('directory',), (directory,))
 
     def _get_maybe_new_terminal_id(self, db, terminal):
         if terminal is None:
             return None
         return self._get_maybe_new_id(
-            db, 'terminal_list', {'terminal': terminal})
-
-    def _get_maybe_new_id(self, db, table, columns):
-        kvlist = list(columns.items())
-        values = [v for (_, v) in kvlist]
-        sql_select = 'SELECT id FROM "{0}" WHERE {1}'.format(
-            table,
-            ' AND '.join(map('"{0[0]}" = ?'.format, kvlist)),
-        )
+            db, 'terminal_list', ('terminal',), (terminal,))
+
+    def _get_maybe_new_id(self, db, table, names, values, on_insert=None):
+        """
+        Get ID of the row in `table` with `values`, inserting it if needed.
+
+        `on_insert` is called with the ID when a new row is inserted.
+
+        :type  names: tuple of str
+        :arg   names: Column names.  This must be the same for `table`.
+        :type values: tuple
+
+        """
+        cache = self._id_cache
+        if cache is None:
+            return self._select_or_insert_id(
+                db, table, names, values, on_insert)
+        key = (table, values)
+        try:
+            return cache[key]
+        except KeyError:
+            id_val = cache[key] = self._select_or_insert_id(
+                db, table, names, values, on_insert)
+            return id_val
+
+    def _select_or_insert_id(self, db, table, names, values, on_insert):
+        (sql_select, sql_insert) = sql_select_or_insert_id(table, names)
         for (id_val,) in db.execute(sql_select, values):
             return id_val
-        sql_insert = 'INSERT INTO "{0}" ({1}) VALUES ({2})'.format(
-            table,
-            ', '.join(map('"{0[0]}"'.format, kvlist)),
-            ', '.join('?' for _ in kvlist),
-        )
-        db.execute(sql_insert, values)
-        return db.lastrowid
+        if HAS_UPSERT_RETURNING:
+            rows = db.execute(sql_insert_returning_id(table, names),
+                              values).fetchall()
+            if not rows:
+                # Inserted by another process after the SELECT.
+                for (id_val,) in db.execute(sql_select, values):
+                    return id_val
+            (id_val,) = rows[0]
+        else:
+            db.execute(sql_insert, values)
+            id_val = db.lastrowid
+        if on_insert:
+            on_insert(id_val)
+        return id_val
 
     def select_by_command_record(self, crec):
         """
@@ -379,11 +842,17 @@ class DataBase(object):
     def search_command_record(
             self,
             after_context, before_context, context, context_type,
+            raw=False,
             **kwds):
         """
         Search command history.
 
-        :rtype: [CommandRecord]
+        :type raw: bool
+        :arg  raw: Yield :class:`sqlite3.Row` instead of
+                   :class:`CommandRecord`.  Columns are named as the
+                   attributes of :class:`CommandRecord`.
+
+        :rtype: [CommandRecord] or [sqlite3.Row]
 
         """
         if after_context or before_context or context:
@@ -400,11 +869,12 @@ class DataBase(object):
                 after_context, before_context = before_context, after_context
 
         (sql, params, keys) = self._compile_sql_search_command_record(**kwds)
-        records = self._select_rows(CommandRecord, keys, sql, params)
-
-        # SOMEDAY: optimize context search;  do not create CommandRecord
-        #          object for all (including non-matching) records.
-        predicate = lambda r: r.condition
+        if raw:
+            records = self._executing(sql, params)
+            predicate = lambda r: r['condition']
+        else:
+            records = self._select_rows(CommandRecord, keys, sql, params)
+            predicate = lambda r: r.condition
         if context:
             records = include_context(predicate, context, records)
         elif before_context:
@@ -421,11 +891,76 @@ class DataBase(object):
         return records
 
     @classmethod
-    def _compile_sql_search_command_record(
-            cls, limit, unique,
+    def _compile_sql_search_command_record(cls, **kwds):
+        """
+        Compile SQL for :meth:`search_command_record`.
+
+        The SQL depends only on the number of each kind of parameters
+        and on flags such as `unique`, not on the parameters themselves.
+        So the SQL is built once for each such "shape" and cached.
+        Only the list of parameters is built on each call.
+
+        """
+        kwds = cls._adapt_search_kwds(kwds)
+        limit = kwds.pop('limit')
+        shape = tuple(sorted(
+            (k, _search_param_shape(k, v) if k in _SEARCH_PARAM_KEYS
+             else _hashable(v))
+            for (k, v) in kwds.items()))
+        template = _search_template_cache.get(shape)
+        if template is None:
+            if len(_search_template_cache) >= _SEARCH_TEMPLATE_CACHE_SIZE:
+                _search_template_cache.clear()
+            template = _search_template_cache[shape] = \
+                cls._build_search_template(**_search_placeholders(kwds))
+        (sql, param_spec, keys) = template
+        params = [p.resolve(kwds) for p in param_spec]
+        if limit and limit >= 0:
+            sql += ' LIMIT ?'
+            params.append(limit)
+        return (sql, params, keys)
+
+    @staticmethod
+    def _adapt_search_kwds(kwds):
+        """
+        Normalize parameters given to :meth:`search_command_record`.
+
+        All parameters in :data:`_SEARCH_PARAM_KEYS` are converted to
+        lists, times are converted to Unix time and paths are made
+        absolute.  `cwd_under` is merged into `cwd_glob`.  Trigrams of
+        `match_pattern` are stored as `match_pattern_trigrams`.
+
+        """
+        kwds = dict(kwds)
+        kwds['cwd_glob'] = list(kwds['cwd_glob']) + [
+            os.path.join(os.path.abspath(p), "*")
+            for p in kwds.pop('cwd_under')]
+        kwds['cwd'] = [normalize_directory(os.path.abspath(p))
+                       for p in kwds['cwd']]
+        path0 = kwds['sort_by_cwd_distance']
+        kwds['sort_by_cwd_distance'] = (
+            [normalize_directory(os.path.abspath(path0))] if path0 else [])
+        kwds['match_pattern_trigrams'] = [
+            sorted(glob_trigrams(p))
+            if p[:1] in ('*', '?', '[') and not kwds['ignore_case'] else []
+            for p in SQLConstructor._adapt_params(kwds['match_pattern'])]
+        for key in _SEARCH_PARAM_KEYS:
+            kwds[key] = SQLConstructor._adapt_params(kwds[key])
+        for key in ['time_after', 'time_before']:
+            kwds[key] = list(map(convert_ts, kwds[key]))
+            for val in kwds[key]:
+                if not isinstance(val, int):
+                    raise ValueError(
+                        'Cannot parse {0}: {1!r}'.format(key, val))
+        return kwds
+
+    @classmethod
+    def _build_search_template(
+            cls, unique,
             match_pattern, include_pattern, exclude_pattern,
+            match_pattern_trigrams,
             match_regexp, include_regexp, exclude_regexp,
-            cwd, cwd_glob, cwd_under,
+            cwd, cwd_glob,
             time_after, time_before, duration_longer_than, duration_less_than,
             include_exit_code, exclude_exit_code,
             include_session_history_id, exclude_session_history_id,
@@ -437,26 +972,38 @@ class DataBase(object):
             ignore_case,
             additional_columns=[], condition_as_column=False,
             ):
+        """
+        Build ``(sql, params, keys)`` for :meth:`search_command_record`.
+
+        Parameters are passed as :class:`_SearchParam` placeholders.
+        See :meth:`_compile_sql_search_command_record`.
+
+        """
         keys = ['command_history_id', 'command', 'session_history_id',
                 'cwd', 'terminal',
                 'start', 'stop', 'exit_code']
         columns = ['command_history.id', 'CL.command', 'session_id',
                    'DL.directory', 'TL.terminal',
                    'start_time', 'stop_time', 'exit_code']
+        # Conditions on CL.command and DL.directory never match NULL.
+        # Using inner joins for filtered tables is therefore equivalent
+        # and lets SQLite start from the UNIQUE index of the column,
+        # e.g., a range search for "CL.command GLOB 'git *'".
+        filtered = not condition_as_column
+        cl_join = ('JOIN' if filtered and (match_pattern or include_pattern)
+                   else 'LEFT JOIN')
+        dl_join = 'JOIN' if filtered and (cwd or cwd_glob) else 'LEFT JOIN'
         source = (
             'command_history '
-            'LEFT JOIN command_list AS CL ON command_id = CL.id '
-            'LEFT JOIN directory_list AS DL ON directory_id = DL.id '
-            'LEFT JOIN terminal_list AS TL ON terminal_id = TL.id')
-
-        if cwd_under:
-            cwd_glob.extend(os.path.join(os.path.abspath(p), "*")
-                            for p in cwd_under)
+            '{0} command_list AS CL ON command_id = CL.id '
+            '{1} directory_list AS DL ON directory_id = DL.id '
+            'LEFT JOIN terminal_list AS TL ON terminal_id = TL.id'
+        ).format(cl_join, dl_join)
 
         if ignore_case:
-            glob = "glob(lower({1}), lower({0}))".format
+            glob = "lower({0}) GLOB lower({1})".format
         else:
-            glob = "glob({1}, {0})".format
+            glob = "{0} GLOB {1}".format
         regexp = "regexp({1}, {0})"
         eq = '{0} = {1}'
 
@@ -466,29 +1013,34 @@ class DataBase(object):
             # should mean to ignore ``sort_by='command_count'``.
             sort_by = [k for k in sort_by if k != 'command_count']
 
-        sc = SQLConstructor(source, columns, keys, limit=limit)
+        sc = SQLConstructor(source, columns, keys)
         if sort_by_cwd_distance:
             col_cwd_dist = 'PATHDIST(DL.directory, ?)'
             if unique:
                 col_cwd_dist = 'MIN({0})'.format(col_cwd_dist)
             col_cwd_dist += ' AS cwd_distance'
-            path0 = normalize_directory(os.path.abspath(sort_by_cwd_distance))
-            sc.add_column(col_cwd_dist, 'cwd_distance', params=[path0])
+            sc.add_column(col_cwd_dist, 'cwd_distance',
+                          params=sort_by_cwd_distance)
             sc.order_by('cwd_distance', 'DESC' if reverse else 'ASC')
         for k in sort_by:
             sc.order_by(k, 'ASC' if reverse else 'DESC')
         sc.add_matches(glob, 'CL.command',
                        match_pattern, include_pattern, exclude_pattern)
+        for trigram_list in match_pattern_trigrams:
+            # Patterns without literal prefix cannot use the index of
+            # CL.command.  Narrow down commands using trigrams instead.
+            if trigram_list:
+                sc.add_and_matches(
+                    cls._sql_has_trigrams, 'CL.id', [trigram_list],
+                    numq=len(trigram_list),
+                    flatten=itertools.chain.from_iterable)
         sc.add_matches(regexp, 'CL.command',
                        match_regexp, include_regexp, exclude_regexp)
         sc.add_or_matches(glob, 'DL.directory', cwd_glob)
-        sc.add_or_matches(
-            eq, 'DL.directory',
-            [normalize_directory(os.path.abspath(p)) for p in cwd])
-        sc.add_and_matches('DATETIME({0}) >= {1}', 'start_time', time_after)
-        sc.add_and_matches('DATETIME({0}) <= {1}', 'start_time', time_before)
-        comdura = (
-            '(JULIANDAY(stop_time) - JULIANDAY(start_time)) * 60 * 60 * 24')
+        sc.add_or_matches(eq, 'DL.directory', cwd)
+        sc.add_and_matches('{0} >= {1}', 'start_time', time_after)
+        sc.add_and_matches('{0} <= {1}', 'start_time', time_before)
+        comdura = '(stop_time - start_time)'
         sc.add_and_matches('({0} >= {1})', comdura, duration_longer_than)
         sc.add_and_matches('({0} <= {1})', comdura, duration_less_than)
         sc.add_matches(eq, 'exit_code',
@@ -532,9 +1084,18 @@ class DataBase(object):
 
         if condition_as_column:
             sc.move_where_clause_to_column()
+        sc.alias_columns()
 
         return sc.compile()
 
+    @staticmethod
+    def _sql_has_trigrams(lhs, *qs):
+        return (
+            '{0} IN (SELECT command_id FROM command_trigrams '
+            'WHERE trigram IN ({1}) '
+            'GROUP BY command_id HAVING COUNT(*) >= {2})'
+        ).format(lhs, ', '.join(qs), len(qs))
+
     @classmethod
     def _add_environ_searches(
             cls, sc,
@@ -544,8 +1105,8 @@ class DataBase(object):
         if not (match_pattern or include_pattern or exclude_pattern or
                 match_regexp or include_regexp or exclude_regexp):
             return
-        glob = "({0[0]} = {1} AND glob({2}, {0[1]}))".format
-        notglob = "({0[0]} = {1} AND NOT glob({2}, {0[1]}))".format
+        glob = "({0[0]} = {1} AND {0[1]} GLOB {2})".format
+        notglob = "({0[0]} = {1} AND NOT {0[1]} GLOB {2})".format
         regexp = "({0[0]} = {1} AND regexp({2}, {0[1]}))".format
         notregexp = "({0[0]} = {1} AND NOT regexp({2}, {0[1]}))".format
         lhs = ['variable_name', 'variable_value']
@@ -640,7 +1201,7 @@ class DataBase(object):
             match_pattern=[], include_pattern=[], exclude_pattern=[],
             match_regexp=[], include_regexp=[], exclude_regexp=[],
             table_alias='matched_environment_variable'):
-        glob = "({0[0]} = {1} AND glob({2}, {0[1]}))".format
+        glob = "({0[0]} = {1} AND {0[1]} GLOB {2})".format
         regexp = "({0[0]} = {1} AND regexp({2}, {0[1]}))".format
         sc = SQLConstructor(
             'environment_variable',
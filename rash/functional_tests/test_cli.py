@@ -162,8 +162,8 @@ class ShellTestMixIn(FunctionalTestMixIn):
             for f in files:
                 path = os.path.join(root, f)
                 with open(path) as f:
-                    data = json.load(f)
-                yield dict(path=path, data=data)
+                    for line in f:
+                        yield dict(path=path, data=json.loads(line))
 
     def get_all_record_data(self):
         return dict(
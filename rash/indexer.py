@@ -15,10 +15,16 @@
 
 
 import os
-import json
+import fcntl
 import warnings
 
 from .database import DataBase
+from .utils.jsonutils import loads
+
+CLAIMED_PREFIX = 'indexing-'
+"""
+Prefix of JSON Lines files renamed by :meth:`Indexer.claim_record`.
+"""
 
 
 class Indexer(object):
@@ -36,7 +42,7 @@ class Indexer(object):
         :type check_duplicate: bool
         :arg  check_duplicate: See :meth:`DataBase.import_dict`.
         :type       keep_json: bool
-        :arg        keep_json: Do not remove JSON files.
+        :arg        keep_json: Do not remove JSON (Lines) files.
                                Imply ``check_duplicate=True``.
         :type     record_path: str or None
         :arg      record_path: Default to `cfstore.record_path`.
@@ -51,6 +57,7 @@ class Indexer(object):
         self.keep_json = keep_json
         self.record_path = record_path or cfstore.record_path
         self.db = DataBase(cfstore.db_path)
+        self.jsonl_offsets = {}
         if record_path:
             self.check_path(record_path, '`record_path`')
 
@@ -73,35 +80,115 @@ class Indexer(object):
                                  '{command,init,exit}',
                                  '')))
 
-    def index_record(self, json_path):
+    def claim_record(self, json_path):
         """
-        Import `json_path` and remove it if :attr:`keep_json` is false.
+        Rename JSON Lines file at `json_path` to stop shells writing to it.
+
+        Return the new path or None if `json_path` does not exist
+        anymore.  Other files are returned as-is.
+        See also :func:`rash.record.append_json_line`.
+
+        """
+        (dirname, basename) = os.path.split(json_path)
+        if (not basename.endswith('.jsonl') or
+                basename.startswith(CLAIMED_PREFIX)):
+            return json_path
+        claimed = os.path.join(dirname, '{0}{1}-{2}'.format(
+            CLAIMED_PREFIX, os.getpid(), basename))
+        try:
+            os.rename(json_path, claimed)
+        except OSError:
+            if os.path.exists(json_path):
+                raise
+            return None
+        return claimed
+
+    def load_records(self, json_path):
+        """
+        Load `json_path` and return ``(record_type, dcts)``.
+
+        A ``.json`` file has one record and a ``.jsonl`` file has one
+        record per line.  Invalid lines of a ``.jsonl`` file are
+        skipped.  `dcts` is None if a ``.json`` file is invalid, as it
+        may still be being written.
+
+        If :attr:`keep_json` is true, lines of a ``.jsonl`` file which
+        are already loaded are skipped, so that appending a record to
+        it does not load the whole file again.  The offsets are kept in
+        :attr:`jsonl_offsets`.
+
         """
-        self.logger.debug('Indexing record: %s', json_path)
         json_path = os.path.abspath(json_path)
         self.check_path(json_path, '`json_path`')
+        record_type = self.get_record_type(json_path)
 
-        with open(json_path) as fp:
+        with open(json_path, 'rb') as fp:
+            if not json_path.endswith('.jsonl'):
+                try:
+                    return (record_type, [loads(fp.read())])
+                except ValueError:
+                    warnings.warn(
+                        'Ignoring invalid JSON file at: {0}'
+                        .format(json_path))
+                    return (record_type, None)
+            # Wait for shells appending to this file.
+            fcntl.flock(fp, fcntl.LOCK_SH)
+            if self.keep_json:
+                offset = self.jsonl_offsets.get(json_path, 0)
+                if offset <= os.fstat(fp.fileno()).st_size:
+                    fp.seek(offset)
+            lines = fp.readlines()
+            if self.keep_json:
+                self.jsonl_offsets[json_path] = fp.tell()
+
+        dcts = []
+        for line in lines:
+            if not line.strip():
+                continue
             try:
-                dct = json.load(fp)
+                dcts.append(loads(line))
             except ValueError:
                 warnings.warn(
-                    'Ignoring invalid JSON file at: {0}'.format(json_path))
+                    'Ignoring invalid JSON line in: {0}'.format(json_path))
+        return (record_type, dcts)
+
+    def _claim_and_load(self, json_path):
+        """
+        Return ``(path, record_type, dcts)`` or None if nothing to import.
+        """
+        if not self.keep_json:
+            json_path = self.claim_record(json_path)
+            if json_path is None:
                 return
+        (record_type, dcts) = self.load_records(json_path)
+        if dcts is None:
+            return
+        return (json_path, record_type, dcts)
+
+    def index_record(self, json_path):
+        """
+        Import `json_path` and remove it if :attr:`keep_json` is false.
+        """
+        self.logger.debug('Indexing record: %s', json_path)
+        loaded = self._claim_and_load(json_path)
+        if loaded is None:
+            return
+        (json_path, record_type, dcts) = loaded
 
-        record_type = self.get_record_type(json_path)
-        kwds = {}
         if record_type == 'command':
-            importer = self.db.import_dict
-            kwds.update(check_duplicate=self.check_duplicate)
+            self.db.import_dicts(dcts, self.check_duplicate)
         elif record_type == 'init':
-            importer = self.db.import_init_dict
+            for dct in dcts:
+                self.db.import_init_dict(dct)
         elif record_type == 'exit':
-            importer = self.db.import_exit_dict
+            for dct in dcts:
+                self.db.import_exit_dict(dct)
         else:
             raise ValueError("Unknown record type: {0}".format(record_type))
-        importer(dct, **kwds)
 
+        self.remove_record(json_path)
+
+    def remove_record(self, json_path):
         if not self.keep_json:
             self.logger.info('Removing JSON record: %s', json_path)
             os.remove(json_path)
@@ -111,15 +198,32 @@ class Indexer(object):
         Yield paths to record files.
         """
         for (root, _, files) in os.walk(self.record_path):
-            for f in (f for f in files if f.endswith('.json')):
-                yield os.path.join(root, f)
+            for f in files:
+                if f.endswith(('.json', '.jsonl')):
+                    yield os.path.join(root, f)
 
     def index_all(self):
         """
         Index all records under :attr:`record_path`.
+
+        Command records are buffered and imported at once using
+        :meth:`DataBase.import_dicts`.
+
         """
         self.logger.debug('Start indexing all records under: %s',
                           self.record_path)
+        command_paths = []
+        command_dcts = []
         with self.db.connection():
             for json_path in sorted(self.find_record_files()):
-                self.index_record(json_path)
+                if self.get_record_type(json_path) != 'command':
+                    self.index_record(json_path)
+                    continue
+                self.logger.debug('Indexing record: %s', json_path)
+                loaded = self._claim_and_load(json_path)
+                if loaded is not None:
+                    command_paths.append(loaded[0])
+                    command_dcts.extend(loaded[2])
+            self.db.import_dicts(command_dcts, self.check_duplicate)
+        for json_path in command_paths:
+            self.remove_record(json_path)
@@ -7,7 +7,8 @@ Probably it makes sense to write this command naively in
 shells to make it faster.
 
 The dumped data goes under the ``~/.config/rash/data/record``
-directory.
+directory.  Records are appended to one JSON Lines file per record
+type and day, e.g., ``command/2013-06-01.jsonl``.
 
 """
 
@@ -29,17 +30,33 @@ directory.
 
 import os
 import time
-import json
+import fcntl
 
 from .utils.pathutils import mkdirp
 from .utils.py3compat import getcwd
+from .utils.jsonutils import dumps
 from .config import ConfigStore
 
 
+_cache = {}
+"""
+Values which do not change during the lifetime of the process.
+"""
+
+
 def get_tty():
     """
     Return \"os.ttyname(0 or 1 or 2)\".
+
+    The result is cached as the TTY of a process does not change.
+
     """
+    if 'tty' not in _cache:
+        _cache['tty'] = _get_tty()
+    return _cache['tty']
+
+
+def _get_tty():
     for i in range(3):
         try:
             return os.ttyname(i)
@@ -73,8 +90,7 @@ def get_environ(keys):
             subenv[key] = value
 
     if needset('HOST'):
-        import platform
-        subenv['HOST'] = platform.node()
+        subenv['HOST'] = _host()
     if needset('TTY'):
         setifnonempty('TTY', get_tty())
     if needset('RASH_SPENV_TERMINAL'):
@@ -83,6 +99,16 @@ def get_environ(keys):
     return subenv
 
 
+def _host():
+    """
+    Return (cached) :meth:`platform.node`.
+    """
+    if 'host' not in _cache:
+        import platform
+        _cache['host'] = platform.node()
+    return _cache['host']
+
+
 def generate_session_id(data):
     """
     Generate session ID based on HOST, TTY, PID [#]_ and start time.
@@ -115,7 +141,7 @@ def record_run(record_type, print_session_id, **kwds):
     envkeys = config.record.environ[record_type]
     json_path = os.path.join(cfstore.record_path,
                              record_type,
-                             time.strftime('%Y-%m-%d-%H%M%S.json'))
+                             time.strftime('%Y-%m-%d.jsonl'))
     mkdirp(os.path.dirname(json_path))
 
     # Command line options directly map to record keys
@@ -135,8 +161,34 @@ def record_run(record_type, print_session_id, **kwds):
         data['session_id'] = generate_session_id(data)
         print(data['session_id'])
 
-    with open(json_path, 'w') as fp:
-        json.dump(data, fp)
+    append_json_line(json_path, data)
+
+
+def append_json_line(path, data):
+    """
+    Append `data` to the JSON Lines file at `path`.
+
+    Several shells may append to the same file at the same time.
+    Each record is written by one ``write`` call to a file opened
+    in append mode, while holding an exclusive :func:`fcntl.flock`.
+    The indexer renames the file before reading it (see
+    :meth:`rash.indexer.Indexer.claim_record`).  If it was renamed
+    while we were waiting for the lock, the line is written to a
+    new file at `path` instead.
+
+    """
+    line = dumps(data) + b'\n'
+    while True:
+        with open(path, 'ab') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                renamed = not os.path.samestat(os.fstat(fp.fileno()),
+                                               os.stat(path))
+            except OSError:
+                renamed = True
+            if not renamed:
+                fp.write(line)
+                return
 
 
 def record_add_arguments(parser):
@@ -23,21 +23,29 @@ CREATE TABLE command_history (
   -- SOMEDAY: Remove terminal_id or move this to session_history table.
   -- See the comment in record_run (./record.py).
   terminal_id INTEGER,
-  start_time TIMESTAMP,
-  stop_time TIMESTAMP,
+  start_time INTEGER,  -- Unix time
+  stop_time INTEGER,
   exit_code INTEGER,
   FOREIGN KEY(command_id) REFERENCES command_list(id),
   FOREIGN KEY(session_id) REFERENCES session_history(id),
   FOREIGN KEY(directory_id) REFERENCES directory_list(id),
   FOREIGN KEY(terminal_id) REFERENCES terminal_list(id)
 );
+CREATE INDEX IF NOT EXISTS idx_ch_start_time
+  ON command_history(start_time);
+CREATE INDEX IF NOT EXISTS idx_ch_command_id
+  ON command_history(command_id);
+CREATE INDEX IF NOT EXISTS idx_ch_directory_id
+  ON command_history(directory_id);
+CREATE INDEX IF NOT EXISTS idx_ch_terminal_id
+  ON command_history(terminal_id);
 
 DROP TABLE IF EXISTS session_history;
 CREATE TABLE session_history (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
   session_long_id TEXT NOT NULL UNIQUE,
-  start_time TIMESTAMP,
-  stop_time TIMESTAMP
+  start_time INTEGER,  -- Unix time
+  stop_time INTEGER
 );
 
 DROP TABLE IF EXISTS command_list;
@@ -46,6 +54,16 @@ CREATE TABLE command_list (
   command TEXT NOT NULL UNIQUE
 );
 
+-- Trigrams (substrings of length 3) of commands.  This is used to
+-- narrow down commands before matching them against patterns without
+-- literal prefix such as "*make*".
+CREATE TABLE IF NOT EXISTS command_trigrams (
+  trigram TEXT NOT NULL,
+  command_id INTEGER NOT NULL,
+  PRIMARY KEY(trigram, command_id),
+  FOREIGN KEY(command_id) REFERENCES command_list(id)
+);
+
 DROP TABLE IF EXISTS terminal_list;
 CREATE TABLE terminal_list (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -58,6 +76,8 @@ CREATE TABLE environment_variable (
   variable_name TEXT NOT NULL,
   variable_value TEXT NOT NULL
 );
+CREATE UNIQUE INDEX IF NOT EXISTS idx_environment_variable
+  ON environment_variable(variable_name, variable_value);
 
 DROP TABLE IF EXISTS directory_list;
 CREATE TABLE directory_list (
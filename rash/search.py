@@ -13,6 +13,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import re
+
 
 SORT_KEY_SYNONYMS = {
     'count': 'command_count',
@@ -26,6 +28,17 @@ SORT_KEY_SYNONYMS = {
 }
 
 
+RECORD_ONLY_KEYS = set(['session_id', 'environ', 'pipestatus'])
+"""
+Format keys available in CommandRecord but not in rows from DB.
+"""
+
+TIME_KEYS = set(['start', 'stop'])
+"""
+Format keys holding Unix time, printed as UTC time strings.
+"""
+
+
 def search_run(output, **kwds):
     """
     Search command history.
@@ -34,23 +47,36 @@ def search_run(output, **kwds):
     from .config import ConfigStore
     from .database import DataBase
     from .query import expand_query, preprocess_kwds
+    from .utils.py3compat import PY3
+    from .utils.timeutils import format_timestamp
 
     cfstore = ConfigStore()
     kwds = expand_query(cfstore.get_config(), kwds)
     format = get_formatter(**kwds)
-    fmtkeys = formatter_keys(format)
+    fmtkeys = set(formatter_keys(format))
     candidates = set([
         'command_count', 'success_count', 'success_ratio', 'program_count'])
-    kwds['additional_columns'] = candidates & set(fmtkeys)
+    kwds['additional_columns'] = candidates & fmtkeys
+    # Use rows from DB as-is unless CommandRecord-only keys are needed.
+    raw = not fmtkeys & RECORD_ONLY_KEYS
+    timekeys = fmtkeys & TIME_KEYS
 
     db = DataBase(cfstore.db_path)
-    for crec in db.search_command_record(**preprocess_kwds(kwds)):
-        # output.write(format.format(**crec.__dict__))
-        # quick hack for ascii printability
-        for k, v in crec.__dict__.items():
-            if isinstance(v, unicode):
-                crec.__dict__[k] = v.encode('ascii', errors='replace')
-        output.write(format.format(**crec.__dict__))
+    for rec in db.search_command_record(raw=raw, **preprocess_kwds(kwds)):
+        if raw:
+            fields = rec
+        else:
+            fields = rec.__dict__
+        if timekeys or not PY3:
+            fields = dict((k, fields[k]) for k in fields.keys())
+        for k in timekeys:
+            fields[k] = format_timestamp(fields[k])
+        if not PY3:
+            # quick hack for ascii printability
+            for (k, v) in fields.items():
+                if isinstance(v, unicode):
+                    fields[k] = v.encode('ascii', errors='replace')
+        output.write(format.format(**fields))
 
 
 def get_formatter(
@@ -75,12 +101,14 @@ def formatter_keys(format_string):
     """
     Return required fields in `format_string`.
 
-    >>> sorted(formatter_keys('{1} {key}'))
-    ['1', 'key']
+    >>> sorted(formatter_keys('{1} {key} {environ[PATH]} {a.b}'))
+    ['1', 'a', 'environ', 'key']
 
     """
     from string import Formatter
-    return (tp[1] for tp in Formatter().parse(format_string))
+    return (re.split(r'[.[]', tp[1], 1)[0]
+            for tp in Formatter().parse(format_string)
+            if tp[1] is not None)
 
 
 def search_add_arguments(parent_parser):
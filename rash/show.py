@@ -21,11 +21,14 @@ def show_run(command_history_id):
     from pprint import pprint
     from .config import ConfigStore
     from .database import DataBase
+    from .utils.timeutils import format_timestamp
     db = DataBase(ConfigStore().db_path)
     with db.connection():
         for ch_id in command_history_id:
             crec = db.get_full_command_record(ch_id)
-            pprint(crec.__dict__)
+            pprint(dict(crec.__dict__,
+                        start=format_timestamp(crec.start),
+                        stop=format_timestamp(crec.stop)))
             print("")
 
 
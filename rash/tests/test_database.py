@@ -31,17 +31,8 @@ def setdefaults(d, **kwds):
         d.setdefault(k, v)
 
 
-def to_sql_timestamp(ts):
-    if ts is not None:
-        dt = datetime.datetime.utcfromtimestamp(ts)
-        return dt.strftime("%Y-%m-%d %H:%M:%S")
-
-
 def to_record(recclass, data):
-    crec = recclass(**data)
-    crec.start = to_sql_timestamp(crec.start)
-    crec.stop = to_sql_timestamp(crec.stop)
-    return crec
+    return recclass(**data)
 
 
 def to_command_record(data):
@@ -213,6 +204,45 @@ class TestInMemoryDataBase(BaseTestCase):
         self.assert_same_command_record(records[0], to_command_record(data))
         self.assertEqual(len(records), 1)
 
+    def test_import_dicts(self):
+        data_list = []
+        for i in range(3):
+            data = self.get_dummy_command_record_data()
+            data.update(start=i, pipestatus=[i, 0],
+                        environ={'PATH': 'DUMMY:PATH:{0}'.format(i)})
+            self.adapt_file_path_in_dict(data)
+            data_list.append(data)
+        # The last one is a duplicate of the first one:
+        self.db.import_dicts(data_list + data_list[:1])
+
+        records = self.search_command_record(unique=False, reverse=True)
+        self.assertEqual(len(records), len(data_list))
+        for (crec, data) in zip(records, data_list):
+            self.assert_same_command_record(crec, to_command_record(data))
+            full = self.db.get_full_command_record(crec.command_history_id)
+            self.assertEqual(full.pipestatus, data['pipestatus'])
+            self.assertEqual(full.environ['PATH'], data['environ']['PATH'])
+
+    def test_import_dicts_without_upsert(self):
+        from .. import database
+        with monkeypatch(database, 'HAS_UPSERT_RETURNING', False):
+            self.test_import_dicts()
+
+    def test_import_existing_command_keeps_ids(self):
+        data = self.get_dummy_command_record_data()
+        for i in range(5):
+            self.import_command_record(dict(data, command='ls', start=i))
+        self.import_command_record(dict(data, command='git'))
+        with self.db.connection() as db:
+            self.assertEqual(
+                list(map(tuple, db.execute(
+                    'SELECT id, command FROM command_list ORDER BY id'))),
+                [(1, 'ls'), (2, 'git')])
+            # Each trigram is inserted only once for each command:
+            (count,) = db.execute(
+                'SELECT COUNT(*) FROM command_trigrams').fetchone()
+            self.assertEqual(count, 1)
+
     def prepare_command_history_table(self, keys, lists):
         """
         Import command records specified by values in `lists`.
@@ -273,6 +303,33 @@ class TestInMemoryDataBase(BaseTestCase):
                                              unique=False)
         self.assertEqual(len(records), 0)
 
+    def test_search_command_by_infix_pattern(self):
+        (dcrec1, dcrec2, dcrec3) = self.prepare_command_record(
+            command=['git status', 'hg status', 'git st'])
+        for pattern in ['*it st*', '*i? st*', '*[g]it st*']:
+            records = self.search_command_record(match_pattern=[pattern],
+                                                 unique=False, reverse=True)
+            self.assertEqual(attrs(records, 'command'),
+                             [dcrec1.command, dcrec3.command])
+        records = self.search_command_record(
+            match_pattern=['*status*', '*g st*'], unique=False)
+        self.assertEqual(attrs(records, 'command'), [dcrec2.command])
+
+    def test_compile_search_reuses_sql_of_same_shape(self):
+        kwds = self.get_default_search_kwds()
+        for key in ['after_context', 'before_context', 'context',
+                    'context_type']:
+            del kwds[key]
+        compile_sql = self.db._compile_sql_search_command_record
+        (sql1, params1, _) = compile_sql(**dict(kwds, cwd=['/a']))
+        (sql2, params2, _) = compile_sql(**dict(kwds, cwd=['/b']))
+        (sql3, params3, _) = compile_sql(**dict(kwds, cwd=['/a', '/b']))
+        self.assertEqual(sql1, sql2)
+        self.assertNotEqual(sql1, sql3)
+        self.assertEqual(params1[0], normalize_directory(os.path.abspath('/a')))
+        self.assertEqual(params2[0], normalize_directory(os.path.abspath('/b')))
+        self.assertEqual(len(params3), len(params1) + 1)
+
     def test_search_command_by_exclude_pattern(self):
         (dcrec1, dcrec2) = self.prepare_command_record()
 
@@ -362,6 +419,79 @@ class TestInMemoryDataBase(BaseTestCase):
             cwd_glob=[self.abspath('REAL', '*')], unique=False)
         self.assertEqual(len(records), 0)
 
+    def test_search_command_by_time(self):
+        self.prepare_command_record(command=['A', 'B', 'C'],
+                                    start=[100, 200, 300],
+                                    stop=[101, 260, 400])
+        utc = datetime.datetime.utcfromtimestamp
+        records = self.search_command_record(time_after=utc(150))
+        self.assertEqual(sorted(attrs(records, 'command')), ['B', 'C'])
+        records = self.search_command_record(time_before=utc(200))
+        self.assertEqual(sorted(attrs(records, 'command')), ['A', 'B'])
+        records = self.search_command_record(duration_longer_than=60)
+        self.assertEqual(sorted(attrs(records, 'command')), ['B', 'C'])
+        self.assertEqual(attrs(records, 'start'), [300, 200])
+
+    def test_search_command_by_time_string(self):
+        # Time strings are kept as-is without parsedatetime.
+        self.prepare_command_record(command=['old', 'new'],
+                                    start=[978307200,    # 2001-01-01
+                                           1483228800])  # 2017-01-01
+        records = self.search_command_record(time_after='2010-01-01')
+        self.assertEqual(attrs(records, 'command'), ['new'])
+        records = self.search_command_record(time_before='2010-01-01')
+        self.assertEqual(attrs(records, 'command'), ['old'])
+        self.assertRaises(ValueError, self.search_command_record,
+                          time_after='yesterday-ish')
+
+    def test_migrate_timestamps(self):
+        from .. import database
+        with self.db.connection(commit=True) as db:
+            db.execute(
+                "INSERT INTO command_history (start_time, stop_time) "
+                "VALUES ('1970-01-01 00:01:40', '1970-01-01 00:01:42')")
+            db.execute(
+                "INSERT INTO session_history "
+                "(session_long_id, start_time, stop_time) "
+                "VALUES ('DUMMY-SESSION-ID', '1970-01-01 00:01:40', NULL)")
+        with monkeypatch(database, 'schema_version', '0.1'):
+            self.db.update_version_records()
+        self.db._migrate_timestamps()
+        with self.db.connection() as db:
+            self.assertEqual(
+                list(map(tuple, db.execute(
+                    'SELECT start_time, stop_time FROM command_history '
+                    'UNION ALL '
+                    'SELECT start_time, stop_time FROM session_history'))),
+                [(100, 102), (100, None)])
+
+    def test_ensure_schema_merges_duplicated_environ(self):
+        with self.db.connection(commit=True) as db:
+            db.execute('DROP INDEX idx_environment_variable')
+            db.executemany(
+                'INSERT INTO environment_variable '
+                '(id, variable_name, variable_value) VALUES (?, ?, ?)',
+                [(1, 'A', '1'), (2, 'B', '2'), (3, 'A', '1')])
+            db.executemany(
+                'INSERT INTO command_environment_map (ch_id, ev_id) '
+                'VALUES (?, ?)', [(1, 2), (1, 3)])
+            db.execute(
+                'INSERT INTO session_environment_map (sh_id, ev_id) '
+                'VALUES (1, 3)')
+        self.db._ensure_schema()
+        with self.db.connection() as db:
+            select = lambda sql: list(map(tuple, db.execute(sql)))
+            self.assertEqual(
+                select('SELECT id FROM environment_variable ORDER BY id'),
+                [(1,), (2,)])
+            self.assertEqual(
+                select('SELECT ev_id FROM command_environment_map '
+                       'ORDER BY ev_id'),
+                [(1,), (2,)])
+            self.assertEqual(
+                select('SELECT ev_id FROM session_environment_map'),
+                [(1,)])
+
     def test_search_command_sort_by_command_count(self):
         command_num_pairs = [('command A', 10),
                              ('command B', 5),
@@ -384,6 +514,16 @@ class TestInMemoryDataBase(BaseTestCase):
         counts = [r.command_count for r in records]
         self.assertEqual(counts, [15, 10, 5])
 
+    def test_search_command_raw(self):
+        self.prepare_command_record(command=['git status', 'hg status'])
+        for kwds in [dict(sort_by=['command_count']), dict(context=1)]:
+            crecs = self.search_command_record(**kwds)
+            rows = self.search_command_record(raw=True, **kwds)
+            self.assertEqual(len(rows), len(crecs))
+            for (row, crec) in zip(rows, crecs):
+                for key in row.keys():
+                    self.assertEqual(row[key], getattr(crec, key))
+
     def prepare_command_record_from_exit_codes(self, exit_codes):
         commands = ['COMMAND-{0}'.format(i)
                     for (i, codes) in enumerate(exit_codes) for _ in codes]
@@ -489,6 +629,24 @@ class TestInMemoryDataBase(BaseTestCase):
         self.assertEqual(len(first_half), small_num)
         self.assertEqual(len(second_half), 0)
 
+    def test_connection_is_kept(self):
+        with self.db.connection() as db1:
+            pass
+        with self.db.connection() as db2:
+            pass
+        self.assertIs(db1, db2)
+
+    def test_connection_rollback_on_error(self):
+        try:
+            with self.db.connection(commit=True) as db:
+                db.execute("INSERT INTO command_list (command) VALUES ('A')")
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        with self.db.connection() as db:
+            (count,) = db.execute('SELECT COUNT(*) FROM command_list')
+        self.assertEqual(tuple(count), (0,))
+
     def search_environ_record(self, **kwds):
         return list(self.db.search_environ_record(**kwds))
 
@@ -81,3 +81,76 @@ class TestIndexer(BaseTestCase):
         indexer.index_all()
         actual_paths = list(indexer.find_record_files())
         self.assertEqual(actual_paths, [])
+
+    def prepare_jsonl_records(self, **records):
+        from ..record import append_json_line
+        paths = []
+        for (rectype, data_list) in records.items():
+            json_path = os.path.join(self.cfstore.record_path,
+                                     rectype, '2013-06-01.jsonl')
+            mkdirp(os.path.dirname(json_path))
+            for data in data_list:
+                append_json_line(json_path, data)
+            paths.append(json_path)
+        return paths
+
+    def get_command_count(self, indexer):
+        with indexer.db.connection() as connection:
+            (count,) = connection.execute(
+                'SELECT COUNT(*) FROM command_history').fetchone()
+        return count
+
+    def test_index_all_jsonl_and_discard_json(self):
+        records = self.get_dummy_records(num_command=3, num_init=2)
+        self.prepare_jsonl_records(**records)
+        indexer = self.get_indexer(keep_json=False)
+        indexer.index_all()
+        self.assertEqual(list(indexer.find_record_files()), [])
+        self.assertEqual(self.get_command_count(indexer), 3)
+        self.assertEqual(len(list(indexer.db.search_session_record('SID-1'))),
+                         1)
+
+    def test_index_record_jsonl_and_keep_json(self):
+        records = self.get_dummy_records(num_command=3)
+        [json_path] = self.prepare_jsonl_records(command=records['command'])
+        indexer = self.get_indexer(keep_json=True)
+        indexer.index_record(json_path)
+        indexer.index_record(json_path)
+        self.assertEqual(list(indexer.find_record_files()), [json_path])
+        self.assertEqual(self.get_command_count(indexer), 3)
+
+    def test_append_after_claim_record(self):
+        from ..record import append_json_line
+        [json_path] = self.prepare_jsonl_records(command=[{'start': 0}])
+        indexer = self.get_indexer(keep_json=False)
+        claimed = indexer.claim_record(json_path)
+        self.assertNotEqual(claimed, json_path)
+        append_json_line(json_path, {'start': 1})
+        (_, dcts) = indexer.load_records(claimed)
+        self.assertEqual(dcts, [{'start': 0}])
+        (_, dcts) = indexer.load_records(json_path)
+        self.assertEqual(dcts, [{'start': 1}])
+
+    def test_load_records_with_surrogate_escape(self):
+        # Command decoded from non-UTF-8 bytes using surrogateescape:
+        command = 'ls \udcff'
+        [json_path] = self.prepare_jsonl_records(
+            command=[{'command': command}])
+        with open(json_path, 'a') as f:
+            f.write(json.dumps({'command': command}) + '\n')
+        indexer = self.get_indexer(keep_json=True)
+        (_, dcts) = indexer.load_records(json_path)
+        self.assertEqual(dcts, [{'command': command}] * 2)
+
+    def test_load_records_jsonl_keep_json_skips_loaded_lines(self):
+        from ..record import append_json_line
+        [json_path] = self.prepare_jsonl_records(
+            command=[{'start': 0}, {'start': 1}])
+        indexer = self.get_indexer(keep_json=True)
+        (_, dcts) = indexer.load_records(json_path)
+        self.assertEqual(dcts, [{'start': 0}, {'start': 1}])
+        append_json_line(json_path, {'start': 2})
+        (_, dcts) = indexer.load_records(json_path)
+        self.assertEqual(dcts, [{'start': 2}])
+        (_, dcts) = indexer.load_records(json_path)
+        self.assertEqual(dcts, [])
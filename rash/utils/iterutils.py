@@ -34,10 +34,6 @@ def nonempty(iterative):
     return False
 
 
-def repeat(item, num):
-    return itertools.islice(itertools.repeat(item), num)
-
-
 def _backward_shifted_predicate(predicate, num, iterative, include_zero=True):
     queue = []
     for elem in iterative:
@@ -0,0 +1,71 @@
+# Copyright (C) 2013-  Takafumi Arakaki
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+JSON (de)serialization using orjson_ if available.
+
+.. _orjson: https://pypi.org/project/orjson/
+
+"""
+
+import json
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+
+def dumps(obj):
+    """
+    Serialize `obj` to compact JSON and return it as bytes.
+
+    orjson rejects strings which are not valid UTF-8, such as paths
+    decoded with ``surrogateescape``.  The :mod:`json` module is used
+    for them; it writes such characters as ``\\uXXXX`` escapes.
+
+    >>> dumps({'a': [1, 2]}) == b'{"a":[1,2]}'
+    True
+
+    """
+    if HAS_ORJSON:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass
+    return json.dumps(obj, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data):
+    """
+    Deserialize JSON given as bytes or str.
+
+    Invalid JSON raises :class:`ValueError`.  Data orjson cannot read,
+    such as escaped lone surrogates written by :func:`dumps`, is read
+    by the :mod:`json` module.
+
+    >>> loads(b'{"a":[1,2]}') == {'a': [1, 2]}
+    True
+
+    """
+    if HAS_ORJSON:
+        try:
+            return orjson.loads(data)
+        except ValueError:
+            pass
+    if isinstance(data, bytes):
+        data = data.decode('utf-8')
+    return json.loads(data)
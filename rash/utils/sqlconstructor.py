@@ -15,8 +15,6 @@
 
 import itertools
 
-from .iterutils import repeat
-
 
 def concat_expr(operator, conditions):
     """
@@ -24,9 +22,15 @@ def concat_expr(operator, conditions):
 
     It returns a string in a list or empty list, if `conditions` is empty.
 
+    >>> concat_expr('OR', ['a', 'b'])
+    ['(a OR b)']
+    >>> concat_expr('OR', [])
+    []
+
     """
-    expr = " {0} ".format(operator).join(conditions)
-    return ["({0})".format(expr)] if expr else []
+    if not conditions:
+        return []
+    return ['(' + ' {0} '.format(operator).join(conditions) + ')']
 
 
 def adapt_matcher(matcher):
@@ -225,8 +229,8 @@ class SQLConstructor(object):
         params = self._adapt_params(params)
         qs = ['?'] * numq
         flatten = flatten or self._default_flatten(numq)
-        expr = repeat(adapt_matcher(matcher)(lhs, *qs), len(params))
-        self.conditions.extend(expr)
+        expr = adapt_matcher(matcher)(lhs, *qs)
+        self.conditions.extend([expr] * len(params))
         self.params.extend(flatten(params))
 
     def add_or_matches(self, matcher, lhs, params, numq=1, flatten=None):
@@ -236,8 +240,8 @@ class SQLConstructor(object):
         params = self._adapt_params(params)
         qs = ['?'] * numq
         flatten = flatten or self._default_flatten(numq)
-        expr = repeat(adapt_matcher(matcher)(lhs, *qs), len(params))
-        self.conditions.extend(concat_expr('OR', expr))
+        expr = adapt_matcher(matcher)(lhs, *qs)
+        self.conditions.extend(concat_expr('OR', [expr] * len(params)))
         self.params.extend(flatten(params))
 
     def add_matches(self, matcher, lhs,
@@ -272,6 +276,25 @@ class SQLConstructor(object):
         self.keys.append(key or column)
         self.column_params.extend(params)
 
+    def alias_columns(self):
+        """
+        Name each column by its key, so that rows can be accessed by key.
+
+        >>> sc = SQLConstructor('table', ['c1', 'c2'], ['c1', 'k2'])
+        >>> sc.uniquify_by('c1', 'c2')
+        >>> sc.add_column('COUNT(*) AS count', 'count')
+        >>> sc.alias_columns()
+        >>> (sql, params, keys) = sc.compile()
+        >>> sql
+        'SELECT c1, MAX(c2) AS k2, COUNT(*) AS count FROM table GROUP BY c1'
+
+        """
+        self.columns = [
+            c if c.split('.')[-1] == k or
+            c.lower().endswith(' as {0}'.format(k))
+            else '{0} AS {1}'.format(c, k)
+            for (c, k) in zip(self.columns, self.keys)]
+
     def move_where_clause_to_column(self, column='condition', key=None):
         """
         Move whole WHERE clause to a column named `column`.
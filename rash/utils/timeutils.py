@@ -33,6 +33,24 @@ def parse_datetime(string):
         return datetime.datetime.utcfromtimestamp(time.mktime(dates[0]))
 
 
+DISPLAY_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def format_timestamp(timestamp):
+    """
+    Format Unix time `timestamp` as a human readable UTC time string.
+
+    >>> format_timestamp(1369999999)
+    '2013-05-31 11:33:19'
+    >>> format_timestamp(None) is None
+    True
+
+    """
+    if timestamp is None:
+        return
+    return time.strftime(DISPLAY_TIME_FORMAT, time.gmtime(timestamp))
+
+
 def parse_duration(string):
     """
     Parse human readable duration.
@@ -14,17 +14,20 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
 import time
 import signal
 
 try:
     from watchdog.events import (
-        FileSystemEventHandler, FileCreatedEvent)
+        FileSystemEventHandler, FileCreatedEvent, FileModifiedEvent)
     assert FileSystemEventHandler  # fool pyflakes
 except ImportError:
     # Dummy class for making this module importable:
     FileSystemEventHandler = object
 
+from .indexer import CLAIMED_PREFIX
+
 
 class RecordHandler(FileSystemEventHandler):
 
@@ -33,9 +36,19 @@ class RecordHandler(FileSystemEventHandler):
         super(RecordHandler, self).__init__(**kwds)
 
     def on_created(self, event):
-        if isinstance(event, FileCreatedEvent):
+        if (isinstance(event, FileCreatedEvent) and
+                event.src_path.endswith('.json')):
             self.__indexer.index_record(event.src_path)
 
+    def on_modified(self, event):
+        # JSON Lines files are created once a day and then appended.
+        path = event.src_path
+        if (isinstance(event, FileModifiedEvent) and
+                path.endswith('.jsonl') and
+                not os.path.basename(path).startswith(CLAIMED_PREFIX) and
+                os.path.exists(path)):
+            self.__indexer.index_record(path)
+
 
 def raise_keyboardinterrupt(_signum, _frame):
     raise KeyboardInterrupt